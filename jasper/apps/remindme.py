@@ -2,7 +2,9 @@
 
 import re
 import enum
+import asyncio
 import datetime
+import functools
 from jasper.models.remindme import RemindMeAccessor
 import jasper.discord.api
 
@@ -38,7 +40,7 @@ class RemindMe(object):
         self._message_regex = re.compile("remindme: (?P<reminder>.*) (on)? (?P<datetime>({}|{}))"
                                          .format(*[f.value for f in DateFormats]), flags=re.IGNORECASE)
 
-    def _add_reminder(self, channel, user, reminder, reminder_date, recurrence_info=None):
+    async def _add_reminder(self, channel, user, reminder, reminder_date, recurrence_info=None):
         message = "Okay , @{user}, I am setting a reminder: {reminder} for {date}" \
             .format(user=user, reminder=reminder,
                     date=reminder_date.strftime(DateParseStrings.EN_US.value))
@@ -46,8 +48,10 @@ class RemindMe(object):
         print("adding reminder for channel: {}, user: {}, reminder: {} "
               "reminder_date: {}, recurrence_info: {}".format(channel, user, reminder,
                                                               reminder_date, recurrence_info))
-        self._db_accessor.
-        self._discord.send_message(channel, message)
+        add_reminder = functools.partial(self._db_accessor.add_reminder, channel, user, reminder_date,
+                                         reminder, recurrence=recurrence_info)
+        await asyncio.get_event_loop().run_in_executor(None, add_reminder)  # keep DB I/O off the event loop
+        await self._discord.send_message(channel, message)
 
     def _poll_for_events(self):
         pass
@@ -92,11 +96,11 @@ class RemindMe(object):
             raise ValueError("Invalid remindme message: {}".format(message))
 
 
-    def __call__(self, payload):
+    async def __call__(self, payload):
         try:
             result = self._parse_message(payload["content"])
-            self._add_reminder(channel=payload["channel_id"], user=payload["author"]["id"],
-                               reminder=result["reminder"], reminder_date=result["datetime"])
+            await self._add_reminder(channel=payload["channel_id"], user=payload["author"]["id"],
+                                     reminder=result["reminder"], reminder_date=result["datetime"])
         except ValueError as e:
             print(e)
-            self._discord.send_message(payload["channel_id"], "Sorry, that was an invalid reminder format.")
+            await self._discord.send_message(payload["channel_id"], "Sorry, that was an invalid reminder format.")
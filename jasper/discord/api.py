@@ -2,17 +2,48 @@
 
 import requests
 import string
+import time
+import asyncio
+import functools
 from jasper.discord import _BASE_URL
 
 
+_GLOBAL_BUCKET = "global"
+_MAX_RATE_LIMIT_RETRIES = 3
+
+
 class Discord(object):
     """ Main class used for interacting with Discord; meant for use with a bot user """
 
-    def __init__(self, auth_token):
+    def __init__(self, auth_token, session=None):
+        """ Constructor
+
+        Args:
+            auth_token:  Bot authentication token, generated by Discord
+            session:     Optional `requests.Session`, which may be shared between clients to pool
+                         connections. Rate limits are still tracked, and waited out, per client
+                         (i.e. per token)
+        """
         self._auth_token = auth_token
+        self._http = session if session else requests
+        self._rate_limits = dict()  # route (or the global bucket) -> reset time (epoch seconds)
+
+    def _rate_limit_delay(self, route):
+        """ Seconds until this client may send on the given route, considering the global limit too """
+        now = time.time()
+        delays = [self._rate_limits.get(bucket, now) - now for bucket in (route, _GLOBAL_BUCKET)]
+        return max(delays)
+
+    def _update_rate_limit(self, route, response):
+        """ Record an exhausted bucket from a response's rate limit headers """
+        if requests.codes.too_many_requests == response.status_code:
+            bucket = _GLOBAL_BUCKET if "true" == response.headers.get("X-RateLimit-Global") else route
+            self._rate_limits[bucket] = time.time() + float(response.headers.get("Retry-After", 1))
+        elif "0" == response.headers.get("X-RateLimit-Remaining"):
+            self._rate_limits[route] = float(response.headers.get("X-RateLimit-Reset", 0))
 
-    def send_message(self, channel_id, content, text_to_speech=False):  # TODO make async
-        """ Send a message to a given channel
+    async def send_message(self, channel_id, content, text_to_speech=False):
+        """ Send a message to a given channel, waiting out this client's rate limits first
 
         Args:
             channel_id:     The id of the channel to send the message to
@@ -21,8 +52,9 @@ class Discord(object):
         Returns:
             The JSON message object returned from the Discord endpoint
         Raises:
-            IOError: The request fails in some manner
+            IOError: The request fails in some manner, or is still rate limited after retrying
         """
+        route = "channels/{}/messages".format(channel_id)
         message = {
             "content": content,
             "text_to_speech": text_to_speech,
@@ -30,8 +62,17 @@ class Discord(object):
         headers = {
             "Authorization": "Bot {}".format(self._auth_token)
         }
-        response = requests.post("{}/channels/{}/messages".format(_BASE_URL, channel_id),
-                                 json=message, headers=headers)  # TODO async
+        for attempt in range(_MAX_RATE_LIMIT_RETRIES + 1):
+            delay = self._rate_limit_delay(route)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # run the blocking request in an executor, so other bots sharing the event loop are not held up
+            post = functools.partial(self._http.post, "{}/{}".format(_BASE_URL, route),
+                                     json=message, headers=headers)
+            response = await asyncio.get_event_loop().run_in_executor(None, post)
+            self._update_rate_limit(route, response)
+            if requests.codes.too_many_requests != response.status_code:
+                break
         if requests.codes.ok == response.status_code:
             return response.json()  # return message object from Discord
         else:
@@ -7,6 +7,7 @@ import sys
 import json
 import enum
 import asyncio
+import collections
 from jasper.discord import _BASE_URL
 
 
@@ -93,6 +94,115 @@ class GatewayOpCodes(enum.Enum):
     HEARTBEAT_ACK = 11
 
 
+class EventPriority(enum.IntEnum):
+    """ Inbound dispatch priorities; lower values are handled first """
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+HIGH_PRIORITY_EVENTS = frozenset([
+    GatewayEvents.READY.value,
+    GatewayEvents.RESUMED.value,
+    GatewayEvents.MESSAGE_CREATE.value,
+    GatewayEvents.MESSAGE_UPDATE.value,
+    GatewayEvents.MESSAGE_DELETE.value,
+    GatewayEvents.MESSAGE_DELETE_BULK.value,
+])
+""" Dispatch events which jump ahead of everything else in the inbound queue """
+
+SHEDDABLE_EVENTS = frozenset([
+    GatewayEvents.TYPING_START.value,
+    GatewayEvents.PRESENCE_UPDATE.value,
+])
+""" Default low-value dispatch events which may be dropped when the inbound queue is under pressure """
+
+
+class InboundEventQueue(object):
+    """ Bounded, priority-aware queue of dispatch payloads received by the gateway """
+
+    def __init__(self, maxsize=1000, shed_threshold=0.75, high_priority=HIGH_PRIORITY_EVENTS,
+                 sheddable=SHEDDABLE_EVENTS):
+        """ Constructor
+
+        Args:
+            maxsize:         Maximum number of payloads held in the queue
+            shed_threshold:  Fraction of `maxsize` above which sheddable events are dropped on arrival
+            high_priority:   Event types (see :py:class:`GatewayEvents`) handled ahead of all others
+            sheddable:       Event types which are low priority, and dropped when the queue is under
+                             pressure. These are the only events ever dropped
+        """
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive, got {}".format(maxsize))
+        self._maxsize = maxsize
+        self._shed_size = min(int(maxsize * shed_threshold), maxsize)
+        self._high_priority = frozenset(high_priority)
+        self._sheddable = frozenset(sheddable) - self._high_priority
+        self._queues = {priority: collections.deque() for priority in EventPriority}
+        self._size = 0
+        self._not_empty = asyncio.Event()
+        self.dropped = collections.Counter()
+        self.overflowed = collections.Counter()
+
+    def __len__(self):
+        return self._size
+
+    def priority(self, event_type):
+        """ Get the :py:class:`EventPriority` for a given event type """
+        if event_type in self._high_priority:
+            return EventPriority.HIGH
+        elif event_type in self._sheddable:
+            return EventPriority.LOW
+        return EventPriority.NORMAL
+
+    def _drop(self, payload):
+        self.dropped[payload["t"]] += 1
+
+    def _evict(self):
+        """ Evict the oldest queued sheddable payload, if any
+
+        Returns:
+            True if a payload was evicted, else False
+        """
+        if self._queues[EventPriority.LOW]:
+            self._drop(self._queues[EventPriority.LOW].popleft())
+            self._size -= 1
+            return True
+        return False
+
+    def put(self, payload):
+        """ Enqueue a dispatch payload without waiting, so the receive loop keeps reading control frames.
+            Sheddable payloads are dropped if the queue is under pressure. Any other payload makes room by
+            evicting a queued sheddable payload, or is queued over `maxsize` and counted in `overflowed`
+
+        Args:
+            payload:   A dictionary object parsed from the JSON payload provided by the gateway
+        Returns:
+            True if the payload was queued, False if it was dropped
+        """
+        priority = self.priority(payload["t"])
+        if EventPriority.LOW == priority:
+            if self._size >= self._shed_size:
+                self._drop(payload)
+                return False
+        elif self._size >= self._maxsize and not self._evict():
+            self.overflowed[payload["t"]] += 1
+        self._queues[priority].append(payload)
+        self._size += 1
+        self._not_empty.set()
+        return True
+
+    async def get(self):
+        """ Wait for and remove the oldest payload of the highest priority available """
+        while not self._size:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        for priority in EventPriority:
+            if self._queues[priority]:
+                self._size -= 1
+                return self._queues[priority].popleft()
+
+
 class Heartbeat(object):
     """ Gateway heartbeat scheduler """
 
@@ -111,21 +221,21 @@ class Heartbeat(object):
         self._running = True
 
     async def _is_running(self):
-        with await self._runlock:
+        async with self._runlock:
             return self._running
 
     async def stop(self):
         """ Stop the currently running heartbeat """
-        with await self._runlock:
+        async with self._runlock:
             if self._running:
                 self._running = False
 
     async def sequence_number(self):
-        with await self._sequence_number_lock:
+        async with self._sequence_number_lock:
             return self._sequence_number
 
     async def set_sequence_number(self, number):
-        with await self._sequence_number_lock:
+        async with self._sequence_number_lock:
             self._sequence_number = number
 
     async def run(self):
@@ -138,24 +248,43 @@ class Heartbeat(object):
 class Gateway(object):
     """ Websockets gateway manager for Discord events """
 
-    def __init__(self, auth_token, version=6):
+    def __init__(self, auth_token, version=6, inbound_queue=None, session=None, drop_report_interval=60,
+                 name="jasper"):
         """ Constructor
 
         Args:
-            auth_token:   Bot authentication token, generated by Discord
-            version:      Gateway version to use
+            auth_token:            Bot authentication token, generated by Discord
+            version:               Gateway version to use
+            inbound_queue:         Optional :py:class:`InboundEventQueue` for dispatch events. A default
+                                   queue will be created if none is provided
+            session:               Optional `requests.Session`, which may be shared between gateways
+            drop_report_interval:  Seconds between reports of events dropped by the inbound queue
+            name:                  Name of the bot, used for logging
         """
+        self.name = name
         self._auth_token = auth_token
+        self._http = session if session else requests
         self._version = version
         self._heartbeat = None
+        self._heartbeat_task = None
         self._websocket = None
         self._runlock = asyncio.Lock()
         self._running = True
         self._event_handlers = dict()
+        self._inbound = inbound_queue if inbound_queue is not None else InboundEventQueue()
+        self._drop_report_interval = drop_report_interval
 
-    def _get_gateway(self):
-        """ Retrieve the gateway URL for making a websocket connection """
-        response = requests.get("{}/gateway".format(_BASE_URL))  # TODO make async
+    @property
+    def dropped_events(self):
+        """ Counter of dispatch events dropped by the inbound queue, keyed on event type """
+        return self._inbound.dropped
+
+    async def _get_gateway(self):
+        """ Retrieve the gateway URL for making a websocket connection. The blocking request runs in an
+            executor, so that other gateways sharing the event loop are not held up
+        """
+        response = await asyncio.get_event_loop().run_in_executor(None, self._http.get,
+                                                                  "{}/gateway".format(_BASE_URL))
         if requests.codes.ok == response.status_code:
             data = response.json()
             self._wss_url = data["url"]
@@ -184,7 +313,7 @@ class Gateway(object):
 
     async def _connect(self):
         """ Connect to the Discord gateway """
-        url = self._get_gateway()
+        url = await self._get_gateway()
         url = "{}?v={}&encoding=json".format(url, self._version)
         self._websocket = await websockets.client.connect(url)
 
@@ -193,32 +322,68 @@ class Gateway(object):
         pass
 
     async def _is_running(self):
-        with await self._runlock:
+        async with self._runlock:
             return self._running
 
     async def stop(self):
         """ Stop the gateway connection loop """
-        with await self._runlock:
+        async with self._runlock:
             if self._running:
                 self._running = False
-                await self._heartbeat.stop()
+                if self._heartbeat:
+                    await self._heartbeat.stop()
+
+    async def _dispatch(self, gateway_handler):
+        """ Drain the inbound queue, handing each dispatch payload to the gateway handler """
+        while await self._is_running():
+            payload = await self._inbound.get()
+            try:
+                await gateway_handler(payload)
+            except asyncio.CancelledError:
+                raise  # a subclass of Exception before Python 3.8
+            except Exception as e:
+                print("Bot {}: handler failed for event type {}: {}".format(self.name, payload["t"], e))
+
+    async def _report_dropped(self):
+        """ Periodically log the events dropped, or queued over capacity, by the inbound queue """
+        reported = None
+        while await self._is_running():
+            await asyncio.sleep(self._drop_report_interval)
+            counts = (dict(self._inbound.dropped), dict(self._inbound.overflowed))
+            if counts != reported and any(counts):
+                print("Bot {}: inbound queue has dropped events: {}; queued over capacity: {}"
+                      .format(self.name, *counts))
+                reported = counts
 
     async def _connect_and_listen(self, gateway_handler):
         await self._connect()
+        event_loop = asyncio.get_event_loop()
+        tasks = [event_loop.create_task(self._dispatch(gateway_handler)),
+                 event_loop.create_task(self._report_dropped())]
+        try:
+            await self._listen()
+        finally:
+            if self._heartbeat_task:
+                tasks.append(self._heartbeat_task)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _listen(self):
         while await self._is_running():
             # here is the main state machine
             data = json.loads(await self._websocket.recv())
             if GatewayOpCodes.HELLO.value == data["op"]:
                 # now, start up the heartbeat
                 self._heartbeat = Heartbeat(data["d"]["heartbeat_interval"] / 1000.0, self._websocket)
-                asyncio.get_event_loop().create_task(self._heartbeat.run())
+                self._heartbeat_task = asyncio.get_event_loop().create_task(self._heartbeat.run())
                 # send an Identify message
                 await self._identify()
             elif GatewayOpCodes.DISPATCH.value == data["op"]:
                 print("Got a dispatch message; data: {}".format(data))
                 await self._heartbeat.set_sequence_number(data["s"])  # the heartbeat needs an updated sequence
                                                                   # number (only available on dispatch messages)
-                await gateway_handler(data)
+                self._inbound.put(data)  # never waits, so control frames behind a backlog are still read
             elif GatewayOpCodes.RECONNECT.value == data["op"]:
                 # we need to reconnect
                 print("Got a reconnect message; data: {}".format(data))
@@ -262,9 +427,18 @@ class Gateway(object):
         else:
             print("no handlers for event type: {}".format(payload["t"]))
 
+    async def listen(self):
+        """ Connect to the gateway and handle events until stopped. Several gateways may listen
+            on the same event loop
+        """
+        try:
+            await self._connect_and_listen(self._gateway_handler)
+        finally:
+            if self._websocket:
+                await self._websocket.close()
+
     def start(self):
         """ Start the gateway event loop """
         print("Connecting to gateway and starting event loop for gateway handler")
         event_loop = asyncio.get_event_loop()
-        event_loop.run_until_complete(self._connect_and_listen(self._gateway_handler))
-        self._websocket.close()
+        event_loop.run_until_complete(self.listen())
@@ -5,27 +5,49 @@ import functools
 import re
 import sqlalchemy
 import json
+import time
 import asyncio
+import requests
 from jasper.discord.gateway import Gateway
 from jasper.discord.gateway import GatewayEvents
+from jasper.discord.gateway import InboundEventQueue
+from jasper.discord.gateway import SHEDDABLE_EVENTS
 from jasper.discord.api import Discord
 from jasper.apps.remindme import RemindMe
 from jasper.models.remindme import RemindMeAccessor
+from jasper.profiling import Profiler
+
+
+HEALTHY_CONNECTION_SECONDS = 60
+""" A gateway connection which stayed up this long resets its bot's count of consecutive failures """
 
 
 class JasperMessageHandler(object):
     """ Discord message create event handler for Jasper operations """
 
-    def __init__(self, discord, notifier, apps):
+    def __init__(self, discord, notifier, apps, profiler=None, admins=(),
+                 profile_seconds=30, max_profile_seconds=300):
         """ Constructor
 
         Args:
-            discord:  A :py:class:`jasper.discord.discord.Discord` instance, used to send messages
-            notifier: String notifier to indicate a message should be picked up by jasper
+            discord:             A :py:class:`jasper.discord.discord.Discord` instance, used to send messages
+            notifier:            String notifier to indicate a message should be picked up by jasper
+            apps:                Apps which handle jasper messages, keyed on their `name`
+            profiler:            Optional :py:class:`jasper.profiling.Profiler`, enabling the `profile`
+                                 admin command
+            admins:              Discord user IDs (snowflake strings; numbers are converted) allowed to
+                                 use admin commands
+            profile_seconds:     Duration of a `profile` session when none is given
+            max_profile_seconds: Upper bound on the duration of a `profile` session
         """
         self._discord = discord
         self._notifier = notifier
         self._apps = { app.name : app for app in apps }
+        self._profiler = profiler
+        self._admins = frozenset(str(admin) for admin in admins)
+        self._profile_seconds = profile_seconds
+        self._max_profile_seconds = max_profile_seconds
+        self._profile_regex = re.compile("{} profile(?: (?P<seconds>\\d+))?$".format(notifier))
 
     def _get_key(self, content):
         for name in self._apps.keys():
@@ -36,12 +58,33 @@ class JasperMessageHandler(object):
     def _is_jasper_message(self, content):
         return re.match(self._notifier, content) is not None
 
+    async def _profile(self, payload):
+        """ Handle the `profile [seconds]` admin command
+
+        Returns:
+            True if the message was a profile command, else False
+        """
+        matches = re.match(self._profile_regex, payload["content"])
+        if not self._profiler or matches is None or payload["author"]["id"] not in self._admins:
+            return False
+        seconds = min(int(matches.group("seconds") or self._profile_seconds), self._max_profile_seconds)
+        if seconds <= 0:
+            message = "Profiling duration must be at least 1 second"
+        elif self._profiler.start(seconds):
+            message = "Profiling for {} seconds".format(seconds)
+        else:
+            message = "A profiling session is already running"
+        await self._discord.send_message(payload["channel_id"], message)
+        return True
+
     async def __call__(self, payload):
+        if await self._profile(payload):
+            return
         if self._is_jasper_message(payload["content"]):
             key = self._get_key(payload["content"])
             handler = self._apps.get(key, None)
             if handler:
-               handler(payload)
+               await handler(payload)
             else:
                 pass  # log something
         else:
@@ -66,21 +109,130 @@ def get_config():
         return json.load(config)
 
 
+def get_bot_configs(config):
+    """ Get the bot identities to host in this process
+
+    Args:
+        config:   dictionary configuration object, optionally with a `BOTS` list. Each bot entry names
+                  the environment variable holding its token in `TOKEN_ENV`, and may set `NAME` (used for
+                  logging) and `NOTIFIER`
+    Returns:
+        a list of bot configuration dictionaries; a single bot using `DISCORD_AUTH_TOKEN` if `BOTS` is unset
+    """
+    return config.get("BOTS", [{"TOKEN_ENV": "DISCORD_AUTH_TOKEN"}])
+
+
+def make_inbound_queue(config):
+    """ Make a gateway's inbound event queue
+
+    Args:
+        config:   dictionary configuration object, optionally with `INBOUND_QUEUE_SIZE`,
+                  `INBOUND_SHED_THRESHOLD` and `SHED_EVENTS` (a list of event types) populated
+    Returns:
+        a :py:class:`jasper.discord.gateway.InboundEventQueue`
+    """
+    return InboundEventQueue(maxsize=config.get("INBOUND_QUEUE_SIZE", 1000),
+                             shed_threshold=config.get("INBOUND_SHED_THRESHOLD", 0.75),
+                             sheddable=config.get("SHED_EVENTS", SHEDDABLE_EVENTS))
+
+
+def make_bot(bot_config, config, engine, session, profiler):
+    """ Wire up the gateway, Discord client and handler registry for one bot identity
+
+    Args:
+        bot_config:  A bot configuration dictionary, as returned by :py:func:`get_bot_configs`
+        config:      dictionary configuration object shared between bots
+        engine:      SQLAlchemy engine shared between bots
+        session:     `requests.Session` shared between bots
+        profiler:    :py:class:`jasper.profiling.Profiler` shared between bots
+    Returns:
+        a :py:class:`jasper.discord.gateway.Gateway` with its handlers registered
+    """
+    auth_token = os.environ[bot_config["TOKEN_ENV"]]
+
+    gateway = Gateway(auth_token, session=session, inbound_queue=make_inbound_queue(config),
+                      drop_report_interval=config.get("DROP_REPORT_SECONDS", 60),
+                      name=bot_config.get("NAME", bot_config["TOKEN_ENV"]))
+    discord = Discord(auth_token, session=session)
+    handler = JasperMessageHandler(discord, bot_config.get("NOTIFIER", "!jasper"),
+                                   [RemindMe(discord, RemindMeAccessor(engine=engine))],
+                                   profiler=profiler, admins=config.get("ADMIN_USER_IDS", []),
+                                   profile_seconds=config.get("PROFILE_SECONDS", 30),
+                                   max_profile_seconds=config.get("PROFILE_MAX_SECONDS", 300))
+    gateway.register_handler(GatewayEvents.MESSAGE_CREATE.value, handler)
+    return gateway
+
+
+async def supervise(gateway, retries=5, backoff=1):
+    """ Run one bot's gateway, reconnecting with exponential backoff when it fails, so that one bot's
+        failures do not affect the others
+
+    Args:
+        gateway:  The bot's :py:class:`jasper.discord.gateway.Gateway`
+        retries:  Consecutive failures to reconnect after before giving up on the bot. A connection which
+                  stayed up for at least `HEALTHY_CONNECTION_SECONDS` resets the count
+        backoff:  Seconds to wait before the first reconnect; doubled after each consecutive failure
+    Raises:
+        The gateway's last exception, once it has failed more than `retries` times in a row
+    """
+    failures = 0
+    while True:
+        started = time.time()
+        try:
+            await gateway.listen()
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            failures = 1 if time.time() - started >= HEALTHY_CONNECTION_SECONDS else failures + 1
+            if failures > retries:
+                print("Bot {} stopped after {} consecutive failures: {}".format(gateway.name, failures, e))
+                raise
+            delay = backoff * 2 ** (failures - 1)
+            print("Bot {} failed: {}; reconnecting in {} seconds".format(gateway.name, e, delay))
+            await asyncio.sleep(delay)
+
+
+async def run_bots(gateways, retries=5, backoff=1):
+    """ Run each bot's gateway on the current event loop until all have stopped. On the way out (including
+        cancellation), every gateway is stopped and its `listen` task cancelled and awaited
+
+    Args:
+        gateways:  a list of :py:class:`jasper.discord.gateway.Gateway`, one per bot
+        retries:   Consecutive failures each bot may reconnect after; see :py:func:`supervise`
+        backoff:   Seconds before a bot's first reconnect; see :py:func:`supervise`
+    Raises:
+        The first bot's exception if every bot has given up, so the process exits with an error
+    """
+    tasks = [asyncio.ensure_future(supervise(gateway, retries, backoff)) for gateway in gateways]
+    try:
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        for gateway in gateways:
+            await gateway.stop()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    failures = [result for result in results if isinstance(result, Exception)]
+    if failures and len(failures) == len(results):
+        raise failures[0]
+
+
 def main():
     """ Main function - all which happens, starts here """
-    auth_token = os.environ["DISCORD_AUTH_TOKEN"]
-
-    gateway = Gateway(auth_token)
-    discord = Discord(auth_token)
     config = get_config()
     engine = make_db_engine(config, os.environ["JASPER_PSQL_USER"], os.environ["JASPER_PSQL_PW"])
-    handler = JasperMessageHandler(discord, "!jasper",
-                                   [RemindMe(discord, RemindMeAccessor(engine=engine))])
-    gateway.register_handler(GatewayEvents.MESSAGE_CREATE.value, handler)
-
+    session = requests.Session()
+    profiler = Profiler(config.get("PROFILE_DIR", "profiles"))
+    profiler.install_signal_handler(config.get("PROFILE_SECONDS", 30))
+    gateways = [make_bot(bot_config, config, engine, session, profiler) for bot_config in get_bot_configs(config)]
+
+    print("Connecting {} bot(s) to the gateway".format(len(gateways)))
+    event_loop = asyncio.get_event_loop()
+    runner = event_loop.create_task(run_bots(gateways, retries=config.get("RECONNECT_RETRIES", 5),
+                                             backoff=config.get("RECONNECT_BACKOFF_SECONDS", 1)))
     try:
-        gateway.start()
-    except Exception as e:
-        asyncio.wait(gateway.stop)
-        print(e)
-        raise e
+        event_loop.run_until_complete(runner)
+    finally:
+        runner.cancel()
+        event_loop.run_until_complete(asyncio.gather(runner, return_exceptions=True))
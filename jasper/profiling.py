@@ -0,0 +1,104 @@
+""" On-demand profiling for live Jasper processes """
+
+import os
+import io
+import signal
+import asyncio
+import cProfile
+import pstats
+import datetime
+import tracemalloc
+
+
+class Profiler(object):
+    """ Opt-in cProfile and tracemalloc sessions which write their reports to disk """
+
+    def __init__(self, output_dir, top=25):
+        """ Constructor
+
+        Args:
+            output_dir:  Directory reports are written to; created if it does not exist
+            top:         Number of entries to include in each report
+        """
+        self._output_dir = output_dir
+        self._top = top
+        self._profile = None
+        self._timer = None
+        self._owns_tracemalloc = False
+
+    @property
+    def running(self):
+        return self._profile is not None
+
+    def start(self, seconds):
+        """ Start a profiling session which stops itself after some number of seconds.
+            Must be called from within the running event loop
+
+        Args:
+            seconds:   Duration of the session
+        Returns:
+            True if a session was started, False if one is already running or cannot be started
+        """
+        if self.running or seconds <= 0:
+            return False
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:  # another profiler is already active
+            print("Unable to start a profiling session: {}".format(e))
+            return False
+        print("Starting a {} second profiling session".format(seconds))
+        self._owns_tracemalloc = not tracemalloc.is_tracing()
+        if self._owns_tracemalloc:
+            tracemalloc.start()
+        self._profile = profile
+        self._timer = asyncio.get_event_loop().call_later(seconds, self._stop_later)
+        return True
+
+    def _stop_later(self):
+        asyncio.ensure_future(self.stop())
+
+    async def stop(self):
+        """ Stop the current profiling session and write its reports. Only disabling the profiler and taking
+            the tracemalloc snapshot happen on the event loop; statistics and file writes run in an executor
+
+        Returns:
+            a list of paths to the reports written, empty if no session was running
+        """
+        if not self.running:
+            return []
+        self._profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        if self._owns_tracemalloc:
+            tracemalloc.stop()  # leave tracing which was already running (e.g. PYTHONTRACEMALLOC) alone
+        self._timer.cancel()
+        profile, self._profile, self._timer = self._profile, None, None
+        prefix = os.path.join(self._output_dir,
+                              "jasper-{}".format(datetime.datetime.now().strftime("%Y%m%dT%H%M%S%f")))
+        paths = await asyncio.get_event_loop().run_in_executor(None, self._write_reports, prefix,
+                                                               profile, snapshot)
+        print("Profiling reports written: {}".format(", ".join(paths)))
+        return paths
+
+    def _write_reports(self, prefix, profile, snapshot):
+        os.makedirs(self._output_dir, exist_ok=True)
+        paths = ["{}.prof".format(prefix), "{}-cpu.txt".format(prefix), "{}-memory.txt".format(prefix)]
+
+        profile.dump_stats(paths[0])
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(self._top)
+        with open(paths[1], "w") as report:
+            report.write(stream.getvalue())
+        with open(paths[2], "w") as report:
+            for stat in snapshot.statistics("lineno")[:self._top]:
+                report.write("{}\n".format(stat))
+        return paths
+
+    def install_signal_handler(self, seconds, signum=signal.SIGUSR1):
+        """ Start a profiling session whenever the process receives the given signal
+
+        Args:
+            seconds:   Duration of each session
+            signum:    Signal to listen for
+        """
+        asyncio.get_event_loop().add_signal_handler(signum, self.start, seconds)
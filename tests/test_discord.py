@@ -3,12 +3,21 @@
 import pytest
 import requests
 import asyncio
+import time
+import threading
+import json
 import jasper.discord.api
+from jasper.discord.gateway import Gateway
+from jasper.discord.gateway import GatewayOpCodes
+from jasper.discord.gateway import InboundEventQueue
+from jasper.discord.gateway import make_payload_json
+from jasper.discord.gateway import to_json
 
 
-def mock_post(status_code, json):
+def mock_post(status_code, json, headers=None):
     def post(*args, **kwargs):
-        return type('Response', (), {"status_code": status_code, "json": lambda : json})
+        return type('Response', (), {"status_code": status_code, "json": lambda : json,
+                                     "headers": headers if headers else {}})
     return post
 
 
@@ -32,3 +41,192 @@ def test_discord(monkeypatch):
 
         loop = asyncio.get_event_loop()
         loop.run_until_complete(send_bad_message())
+
+
+def mock_session(*responses):
+    """ A stand-in for `requests.Session` which serves the given (status_code, headers) responses in turn """
+    responses = list(responses)
+
+    def post(*args, **kwargs):
+        status_code, headers = responses.pop(0) if len(responses) > 1 else responses[0]
+        return mock_post(status_code, {}, headers)()
+    return type('Session', (), {"post": staticmethod(post)})
+
+
+@pytest.fixture(name="slept")
+def record_sleeps(monkeypatch):
+    slept = list()
+
+    async def sleep(delay):
+        slept.append(delay)
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    return slept
+
+
+def test_discord_rate_limits_per_token(slept):
+    exhausted = {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(time.time() + 60)}
+    session = mock_session((requests.codes.ok, exhausted))
+    limited = jasper.discord.api.Discord('auth_token', session=session)
+    other = jasper.discord.api.Discord('other_token', session=session)
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(limited.send_message(100, "uses up the bucket"))
+    loop.run_until_complete(limited.send_message(200, "different channel bucket"))
+    loop.run_until_complete(other.send_message(100, "different token"))
+    assert [] == slept
+
+    loop.run_until_complete(limited.send_message(100, "waits for the reset"))
+    assert 1 == len(slept) and 59 < slept[0] <= 60
+
+
+def test_discord_retries_after_429(slept):
+    session = mock_session((requests.codes.too_many_requests, {"Retry-After": "2", "X-RateLimit-Global": "true"}),
+                           (requests.codes.ok, {}))
+    discord = jasper.discord.api.Discord('auth_token', session=session)
+
+    loop = asyncio.get_event_loop()
+    assert {} == loop.run_until_complete(discord.send_message(100, "retried"))
+    assert 1 == len(slept) and 1 < slept[0] <= 2
+    loop.run_until_complete(discord.send_message(200, "global limit covers every channel"))
+    assert 2 == len(slept)
+
+    session = mock_session((requests.codes.too_many_requests, {"Retry-After": "1"}))
+    discord = jasper.discord.api.Discord('auth_token', session=session)
+    with pytest.raises(IOError):
+        loop.run_until_complete(discord.send_message(100, "never gets through"))
+
+
+def test_discord_request_does_not_block_event_loop():
+    released = threading.Event()
+
+    def post(*args, **kwargs):
+        assert released.wait(1), "the event loop was blocked while the request was in flight"
+        return mock_post(requests.codes.ok, {})()
+    discord = jasper.discord.api.Discord('auth_token', session=type('Session', (), {"post": staticmethod(post)}))
+
+    async def other_bot():
+        released.set()
+
+    async def send_alongside_other_bot():
+        await asyncio.gather(discord.send_message(100, "slow request"), other_bot())
+
+    asyncio.get_event_loop().run_until_complete(send_alongside_other_bot())
+
+
+def make_dispatch(event_type, seqno=1):
+    return {"op": 0, "s": seqno, "t": event_type, "d": {"event": event_type}}
+
+
+def test_inbound_queue_priority():
+    queue = InboundEventQueue(maxsize=10)
+    for event_type in ("TYPING_START", "GUILD_CREATE", "MESSAGE_CREATE"):
+        queue.put(make_dispatch(event_type))
+
+    async def drain():
+        return [(await queue.get())["t"] for _ in range(len(queue))]
+
+    loop = asyncio.get_event_loop()
+    assert ["MESSAGE_CREATE", "GUILD_CREATE", "TYPING_START"] == loop.run_until_complete(drain())
+
+
+def test_inbound_queue_load_shedding():
+    queue = InboundEventQueue(maxsize=3, shed_threshold=0.5)
+    assert queue.put(make_dispatch("PRESENCE_UPDATE"))
+    assert not queue.put(make_dispatch("TYPING_START"))  # shed above threshold
+    assert queue.put(make_dispatch("GUILD_CREATE"))
+    assert queue.put(make_dispatch("GUILD_CREATE"))
+    assert queue.put(make_dispatch("GUILD_MEMBER_ADD"))  # evicts the queued presence update
+    assert 3 == len(queue)
+
+    # the queue is full of events which may not be shed, so the next one is queued over capacity
+    assert queue.put(make_dispatch("MESSAGE_CREATE"))
+    assert 4 == len(queue)
+
+    async def drain():
+        return [(await queue.get())["t"] for _ in range(len(queue))]
+
+    loop = asyncio.get_event_loop()
+    assert ["MESSAGE_CREATE", "GUILD_CREATE", "GUILD_CREATE", "GUILD_MEMBER_ADD"] == loop.run_until_complete(drain())
+    assert {"TYPING_START": 1, "PRESENCE_UPDATE": 1} == queue.dropped
+    assert {"MESSAGE_CREATE": 1} == queue.overflowed
+
+
+class FakeWebsocket(object):
+    """ Serves a scripted sequence of gateway frames, then an invalid session once `drained` is set """
+
+    def __init__(self, frames):
+        self.frames = [to_json(frame) for frame in frames]
+        self.sent = list()
+        self.drained = asyncio.Event()
+        self.closed = False
+
+    async def recv(self):
+        if self.frames:
+            return self.frames.pop(0)
+        await self.drained.wait()
+        return to_json(make_payload_json(GatewayOpCodes.INVALID_SESSION.value, False))
+
+    async def send(self, data):
+        self.sent.append(json.loads(data))
+
+    async def close(self):
+        self.closed = True
+
+
+def test_gateway_listen_and_dispatch():
+    websocket = FakeWebsocket([make_payload_json(GatewayOpCodes.HELLO.value, {"heartbeat_interval": 41250}),
+                               make_dispatch("TYPING_START", seqno=1),
+                               make_dispatch("GUILD_CREATE", seqno=2),
+                               make_dispatch("MESSAGE_CREATE", seqno=3)])
+    gateway = Gateway("auth_token")
+    handled = list()
+
+    async def connect():
+        gateway._websocket = websocket
+
+    async def handler(data):
+        handled.append(data)
+        if 2 == len(handled):
+            raise RuntimeError("handler errors must not stop the dispatcher")
+        if 3 == len(handled):
+            websocket.drained.set()
+
+    gateway._connect = connect
+    for event_type in ("TYPING_START", "GUILD_CREATE", "MESSAGE_CREATE"):
+        gateway.register_handler(event_type, handler)
+
+    loop = asyncio.get_event_loop()
+    with pytest.raises(ConnectionError):
+        loop.run_until_complete(gateway._connect_and_listen(gateway._gateway_handler))
+
+    assert ["MESSAGE_CREATE", "GUILD_CREATE", "TYPING_START"] == [data["event"] for data in handled]
+    assert GatewayOpCodes.IDENTIFY.value == websocket.sent[0]["op"]
+    assert websocket.closed
+    assert 3 == loop.run_until_complete(gateway._heartbeat.sequence_number())
+    assert gateway._heartbeat_task.cancelled()
+
+
+def test_gateway_reads_control_frames_while_queue_full():
+    websocket = FakeWebsocket([make_payload_json(GatewayOpCodes.HELLO.value, {"heartbeat_interval": 41250}),
+                               make_dispatch("GUILD_CREATE", seqno=1),
+                               make_dispatch("GUILD_CREATE", seqno=2),
+                               make_dispatch("GUILD_CREATE", seqno=3),
+                               make_payload_json(GatewayOpCodes.INVALID_SESSION.value, False)])
+    queue = InboundEventQueue(maxsize=1)
+    gateway = Gateway("auth_token", inbound_queue=queue)
+    blocked = asyncio.Event()
+
+    async def connect():
+        gateway._websocket = websocket
+
+    async def handler(data):
+        await blocked.wait()  # a dispatcher which never catches up
+
+    gateway._connect = connect
+    gateway.register_handler("GUILD_CREATE", handler)
+
+    loop = asyncio.get_event_loop()
+    with pytest.raises(ConnectionError):
+        loop.run_until_complete(gateway._connect_and_listen(gateway._gateway_handler))
+    assert websocket.closed
+    assert {"GUILD_CREATE": 2} == queue.overflowed
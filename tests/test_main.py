@@ -0,0 +1,216 @@
+""" Tests for the application entry point """
+
+import asyncio
+import pytest
+import jasper.main
+from jasper.main import JasperMessageHandler
+
+
+class StubDiscord(object):
+    def __init__(self):
+        self.sent = list()
+
+    async def send_message(self, channel_id, content):
+        self.sent.append((channel_id, content))
+
+
+class StubProfiler(object):
+    def __init__(self, started=True):
+        self.started = started
+        self.sessions = list()
+
+    def start(self, seconds):
+        self.sessions.append(seconds)
+        return self.started
+
+
+class StubApp(object):
+    name = "profile"
+
+    def __init__(self):
+        self.payloads = list()
+
+    async def __call__(self, payload):
+        self.payloads.append(payload)
+
+
+def make_message(content, author="1234"):
+    return {"content": content, "channel_id": "100", "author": {"id": author}}
+
+
+def handle(handler, payload):
+    asyncio.get_event_loop().run_until_complete(handler(payload))
+
+
+def test_profile_command():
+    discord, profiler, app = StubDiscord(), StubProfiler(), StubApp()
+    handler = JasperMessageHandler(discord, "!jasper", [app], profiler=profiler, admins=[1234],
+                                   profile_seconds=20, max_profile_seconds=60)
+
+    handle(handler, make_message("!jasper profile"))
+    handle(handler, make_message("!jasper profile 45"))
+    handle(handler, make_message("!jasper profile 99999999"))
+    assert [20, 45, 60] == profiler.sessions
+    assert ("100", "Profiling for 60 seconds") == discord.sent[-1]
+    assert [] == app.payloads
+
+
+def test_profile_command_rejects_zero_seconds():
+    discord, profiler = StubDiscord(), StubProfiler()
+    handler = JasperMessageHandler(discord, "!jasper", [], profiler=profiler, admins=["1234"])
+
+    handle(handler, make_message("!jasper profile 0"))
+    assert [] == profiler.sessions
+    assert [("100", "Profiling duration must be at least 1 second")] == discord.sent
+
+
+def test_profile_command_already_running():
+    discord, profiler = StubDiscord(), StubProfiler(started=False)
+    handler = JasperMessageHandler(discord, "!jasper", [], profiler=profiler, admins=["1234"])
+
+    handle(handler, make_message("!jasper profile 10"))
+    assert [("100", "A profiling session is already running")] == discord.sent
+
+
+def test_profile_command_requires_admin():
+    discord, profiler, app = StubDiscord(), StubProfiler(), StubApp()
+    handler = JasperMessageHandler(discord, "!jasper", [app], profiler=profiler, admins=["1234"])
+
+    payload = make_message("!jasper profile 10", author="5678")
+    handle(handler, payload)
+    assert [] == profiler.sessions
+    assert [payload] == app.payloads  # falls through to the usual app lookup
+
+
+class StubGateway(object):
+    def __init__(self, auth_token, **kwargs):
+        self.auth_token = auth_token
+        self.kwargs = kwargs
+        self.handlers = dict()
+
+    def register_handler(self, event_type, async_handler):
+        self.handlers.setdefault(event_type, list()).append(async_handler)
+
+
+class StubClient(object):
+    def __init__(self, auth_token, session=None):
+        self.auth_token = auth_token
+        self.session = session
+
+
+@pytest.fixture(name="make_bot")
+def stub_make_bot(monkeypatch, sqlite):
+    monkeypatch.setattr(jasper.main, "Gateway", StubGateway)
+    monkeypatch.setattr(jasper.main, "Discord", StubClient)
+    monkeypatch.setenv("DISCORD_AUTH_TOKEN", "default_token")
+    monkeypatch.setenv("OTHER_TOKEN", "other_token")
+    session = object()
+
+    def make_bot(bot_config, config):
+        return jasper.main.make_bot(bot_config, config, sqlite, session, profiler=None)
+    make_bot.session = session
+    make_bot.engine = sqlite
+    return make_bot
+
+
+def test_get_bot_configs():
+    assert [{"TOKEN_ENV": "DISCORD_AUTH_TOKEN"}] == jasper.main.get_bot_configs({})
+    bots = [{"TOKEN_ENV": "OTHER_TOKEN", "NOTIFIER": "!other"}]
+    assert bots == jasper.main.get_bot_configs({"BOTS": bots})
+
+
+def test_make_bot(make_bot):
+    config = {"INBOUND_QUEUE_SIZE": 10, "SHED_EVENTS": ["TYPING_START"]}
+    default, other = [make_bot(bot_config, config) for bot_config in
+                      jasper.main.get_bot_configs({"BOTS": [{"TOKEN_ENV": "DISCORD_AUTH_TOKEN"},
+                                                            {"TOKEN_ENV": "OTHER_TOKEN", "NOTIFIER": "!other"}]})]
+    assert "default_token" == default.auth_token
+    assert "other_token" == other.auth_token
+    assert ["DISCORD_AUTH_TOKEN", "OTHER_TOKEN"] == [default.kwargs["name"], other.kwargs["name"]]
+
+    default_handler, = default.handlers["MESSAGE_CREATE"]
+    other_handler, = other.handlers["MESSAGE_CREATE"]
+    assert default_handler is not other_handler
+    assert "!jasper" == default_handler._notifier
+    assert "!other" == other_handler._notifier
+    assert "default_token" == default_handler._discord.auth_token
+    assert "other_token" == other_handler._discord.auth_token
+
+    assert default.kwargs["session"] is other.kwargs["session"] is make_bot.session
+    assert default_handler._discord.session is other_handler._discord.session is make_bot.session
+    assert default.kwargs["inbound_queue"] is not other.kwargs["inbound_queue"]
+    engines = [handler._apps["remindme"]._db_accessor._engine for handler in (default_handler, other_handler)]
+    assert [make_bot.engine, make_bot.engine] == engines
+
+
+class StubListener(object):
+    """ A gateway whose `listen` fails a number of times, then returns or blocks until cancelled """
+
+    def __init__(self, name, failures=0, block=False):
+        self.name = name
+        self.failures = failures
+        self.block = block
+        self.connections = 0
+        self.finished = False
+        self.cancelled = False
+        self.stopped = False
+
+    async def listen(self):
+        self.connections += 1
+        try:
+            await asyncio.sleep(0)
+            if self.connections <= self.failures:
+                raise ConnectionError("invalid session")
+            for _ in range(10):  # keep running well after any failing bot has given up
+                await asyncio.sleep(0)
+            while self.block:
+                await asyncio.sleep(3600)
+            self.finished = True
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+    async def stop(self):
+        self.stopped = True
+
+
+def run_bots(gateways, **kwargs):
+    asyncio.get_event_loop().run_until_complete(jasper.main.run_bots(gateways, backoff=0, **kwargs))
+
+
+def test_run_bots_reconnects():
+    flaky = StubListener("flaky", failures=2)
+    run_bots([flaky], retries=2)
+    assert 3 == flaky.connections
+    assert flaky.finished
+
+
+def test_run_bots_isolates_failures():
+    failing, healthy = StubListener("failing", failures=10), StubListener("healthy")
+    run_bots([failing, healthy], retries=1)
+    assert 2 == failing.connections
+    assert healthy.finished
+    assert not healthy.cancelled
+
+
+def test_run_bots_raises_once_every_bot_fails():
+    bots = [StubListener("first", failures=10), StubListener("second", failures=10)]
+    with pytest.raises(ConnectionError):
+        run_bots(bots, retries=1)
+    assert all(bot.stopped for bot in bots)
+
+
+def test_run_bots_cancels_on_shutdown():
+    failing, blocked = StubListener("failing", failures=10), StubListener("blocked", block=True)
+    loop = asyncio.get_event_loop()
+    runner = loop.create_task(jasper.main.run_bots([failing, blocked], retries=0, backoff=0))
+
+    async def shutdown():
+        for _ in range(20):
+            await asyncio.sleep(0)
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+
+    loop.run_until_complete(shutdown())
+    assert blocked.cancelled
+    assert failing.stopped and blocked.stopped
@@ -0,0 +1,38 @@
+""" Profiler tests """
+
+import os
+import asyncio
+import tracemalloc
+from jasper.profiling import Profiler
+
+
+def test_profiling_session(tmpdir):
+    profiler = Profiler(str(tmpdir))
+
+    async def profile():
+        assert not profiler.start(0)
+        assert profiler.start(60)
+        assert not profiler.start(60)
+        [str(i) for i in range(1000)]
+        return await profiler.stop()
+
+    loop = asyncio.get_event_loop()
+    paths = loop.run_until_complete(profile())
+    assert not profiler.running
+    assert not tracemalloc.is_tracing()
+    assert sorted(paths) == sorted(os.path.join(str(tmpdir), name) for name in os.listdir(str(tmpdir)))
+    assert [] == loop.run_until_complete(profiler.stop())
+
+
+def test_profiling_leaves_existing_tracemalloc_running(tmpdir):
+    profiler = Profiler(str(tmpdir))
+    tracemalloc.start()
+    try:
+        async def profile():
+            assert profiler.start(60)
+            await profiler.stop()
+
+        asyncio.get_event_loop().run_until_complete(profile())
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()